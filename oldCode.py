@@ -1,28 +1,31 @@
-import time
 import os
+import queue
+import re
+import signal
+import threading
 from pathlib import Path
 
 import pjsua2 as pj
 
 
 # Small .env loader (simple, no external deps)
+# One pass over the whole file: KEY = value, value optionally wrapped in
+# matching single/double quotes. Comment lines and lines without '=' never match.
+_ENV_RE = re.compile(
+    r"""^[ \t]*(?P<key>[^#\s=][^=\n]*?)[ \t]*=[ \t]*"""
+    r"""(?P<q>["']?)(?P<val>.*?)(?P=q)[ \t]*$""",
+    re.MULTILINE,
+)
+
+
 def load_dotenv(dotenv_path=".env"):
     p = Path(dotenv_path)
-    if not p.exists():
+    try:
+        text = p.read_text()
+    except FileNotFoundError:
         return
-    for line in p.read_text().splitlines():
-        line = line.strip()
-        if not line or line.startswith('#'):
-            continue
-        if '=' not in line:
-            continue
-        key, val = line.split('=', 1)
-        key = key.strip()
-        val = val.strip()
-        if (val.startswith('"') and val.endswith('"')) or (val.startswith("'") and val.endswith("'")):
-            val = val[1:-1]
-        if key not in os.environ:
-            os.environ[key] = val
+    for m in _ENV_RE.finditer(text):
+        os.environ.setdefault(*m.group("key", "val"))
 
 
 # try to load `.env` in project root
@@ -41,12 +44,58 @@ SIP_PASSWD = os.getenv("SIP_PASSWD")
 # 5060 會跟別的東西打架就改 0，讓 OS 自動選
 LOCAL_SIP_PORT = 0
 
+# 設 1：不開 pjsua worker threads，所有 SIP/media event 由 main thread 用 libHandleEvents 處理
+# 通話量大時維持預設 0 (worker threads)
+PJ_SINGLE_THREAD = os.getenv("PJ_SINGLE_THREAD", "0") == "1"
+
+# =========================
+# Log queue
+# =========================
+# pjsua2 callback 只把字串丟進 queue 就返回，不會卡在 stdout 的 lock / 慢速 pipe 上
+_log_q = queue.SimpleQueue()
+
+
+def _log(msg):
+    _log_q.put_nowait(msg)
+
+
+def _log_writer():
+    while True:
+        msg = _log_q.get()
+        if msg is None:
+            break
+        print(msg)
+
+
+_log_thread = threading.Thread(target=_log_writer, name="log-writer", daemon=True)
+
 # =========================
 # 全域 calls map
 # =========================
-# key: call.id  (int)
-# val: MyCall 實例
-g_calls = {}
+# index: call.id  (int, pjsua2 給的小整數)
+# val: MyCall 實例，空位為 None
+# call id 不會超過 pjsua 編譯時的 PJSUA_MAX_CALLS (預設 32)，一開始就配好
+PJSUA_MAX_CALLS = getattr(pj, "PJSUA_MAX_CALLS", 32)
+g_calls = [None] * PJSUA_MAX_CALLS
+# 寫入 (含 extend) 都經過這把 lock；讀取直接 index
+g_calls_lock = threading.Lock()
+
+
+def _register_call(call_id, call):
+    with g_calls_lock:
+        if call_id >= len(g_calls):
+            # 保險：pjsua 若用更大的上限編譯，照樣長得上去
+            g_calls.extend([None] * (call_id + 1 - len(g_calls)))
+        g_calls[call_id] = call
+
+
+# 釋放 slot；原本有 call 才回 True
+def _unregister_call(call_id):
+    with g_calls_lock:
+        if call_id < len(g_calls) and g_calls[call_id] is not None:
+            g_calls[call_id] = None
+            return True
+    return False
 
 
 class MyCall(pj.Call):
@@ -59,16 +108,16 @@ class MyCall(pj.Call):
 
     def onCallState(self, prm):
         ci = self.getInfo()
-        print(f"[call {ci.id}] State: {ci.stateText} ({ci.lastReason})")
+        _log(f"[call {ci.id}] State: {ci.stateText} ({ci.lastReason})")
 
         # 通話建立
         if ci.state == pj.PJSIP_INV_STATE_CONFIRMED:
-            print(f"[call {ci.id}] CONFIRMED, bridge to system audio")
+            _log(f"[call {ci.id}] CONFIRMED, bridge to system audio")
 
             try:
                 media = self.getMedia(0)
             except pj.Error:
-                print(f"[call {ci.id}] getMedia(0) failed")
+                _log(f"[call {ci.id}] getMedia(0) failed")
                 return
 
             audio_media = None
@@ -84,26 +133,26 @@ class MyCall(pj.Call):
                 capture = adm.getCaptureDevMedia()
 
                 if playback is None or capture is None:
-                    print(f"[call {ci.id}] Audio devices not available (playback={playback}, capture={capture})")
+                    _log(f"[call {ci.id}] Audio devices not available (playback={playback}, capture={capture})")
                     return
 
                 try:
                     audio_media.startTransmit(playback)
                     capture.startTransmit(audio_media)
                 except pj.Error as err:
-                    print(f"[call {ci.id}] Failed to bridge audio: {err}")
+                    _log(f"[call {ci.id}] Failed to bridge audio: {err}")
                     return
 
                 self.call_media = audio_media
                 self.playback_media = playback
                 self.capture_media = capture
-                print(f"[call {ci.id}] Audio bridged to default devices")
+                _log(f"[call {ci.id}] Audio bridged to default devices")
             else:
-                print(f"[call {ci.id}] Media[0] could not be treated as AudioMedia")
+                _log(f"[call {ci.id}] Media[0] could not be treated as AudioMedia")
 
         # 通話結束
         if ci.state == pj.PJSIP_INV_STATE_DISCONNECTED:
-            print(f"[call {ci.id}] DISCONNECTED, cleanup")
+            _log(f"[call {ci.id}] DISCONNECTED, cleanup")
 
             if self.call_media and self.playback_media:
                 try:
@@ -122,9 +171,8 @@ class MyCall(pj.Call):
             self.capture_media = None
 
             # 從全域 map 移除，讓 Python 可以 GC 掉這個 MyCall
-            if ci.id in g_calls:
-                del g_calls[ci.id]
-                print(f"[call {ci.id}] Removed from g_calls")
+            if _unregister_call(ci.id):
+                _log(f"[call {ci.id}] Removed from g_calls")
 
 
 class MyAccount(pj.Account):
@@ -136,65 +184,85 @@ class MyAccount(pj.Account):
         reason = getattr(ai, "regStatusText", None)
         if reason is None:
             reason = getattr(ai, "regReason", "")
-        print(f"[acc] Reg state: {ai.regIsActive} ({ai.regStatus} {reason})")
+        _log(f"[acc] Reg state: {ai.regIsActive} ({ai.regStatus} {reason})")
 
     def onIncomingCall(self, prm):
         # 建立 MyCall 實例
         call = MyCall(self, prm.callId)
         ci = call.getInfo()
-        print(f"[call {ci.id}] Incoming from: {ci.remoteUri}")
+        _log(f"[call {ci.id}] Incoming from: {ci.remoteUri}")
 
         # ⭐ 關鍵：把 call 存到全域 map 裡，避免 callback 結束被 GC
-        g_calls[ci.id] = call
+        _register_call(ci.id, call)
 
         # 自動接聽 200 OK
         op = pj.CallOpParam()
         op.statusCode = 200
-        print(f"[call {ci.id}] Auto-answer 200 OK")
+        _log(f"[call {ci.id}] Auto-answer 200 OK")
         call.answer(op)
 
 
 def main():
-    ep = pj.Endpoint()
-    ep.libCreate()
-
-    # Endpoint config & log
-    ep_cfg = pj.EpConfig()
-    ep_cfg.logConfig.level = 4
-    ep_cfg.logConfig.consoleLevel = 4
-
-    ep.libInit(ep_cfg)
-
-    # Transport 設定
-    sip_cfg = pj.TransportConfig()
-    sip_cfg.port = LOCAL_SIP_PORT
-    ep.transportCreate(pj.PJSIP_TRANSPORT_UDP, sip_cfg)
-
-    ep.libStart()
-    print(f"[ep] PJSUA2 started, listening on UDP port {sip_cfg.port}")
-
-    # Account 設定
-    acc_cfg = pj.AccountConfig()
-    acc_cfg.idUri = f"sip:{SIP_USER}@{SIP_DOMAIN}"
-    acc_cfg.regConfig.registrarUri = f"sip:{SIP_DOMAIN}"
-
-    # 認證資訊
-    cred = pj.AuthCredInfo("digest", SIP_DOMAIN, SIP_USER, 0, SIP_PASSWD)
-    acc_cfg.sipConfig.authCreds.append(cred)
-
-    # 建立帳號
-    acc = MyAccount()
-    acc.create(acc_cfg)
-    print(f"[acc] Created and registering as {acc_cfg.idUri}")
+    _log_thread.start()
 
+    # 啟動途中 (libInit / transportCreate / acc.create ...) 丟例外也要把 log 印完
     try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        print("\n[ep] Ctrl+C, shutting down...")
+        ep = pj.Endpoint()
+        ep.libCreate()
+
+        # Endpoint config & log
+        ep_cfg = pj.EpConfig()
+        ep_cfg.logConfig.level = 4
+        ep_cfg.logConfig.consoleLevel = 4
+        if PJ_SINGLE_THREAD:
+            # SIP worker threads 和 pjmedia worker thread 都關掉
+            ep_cfg.uaConfig.threadCnt = 0
+            ep_cfg.medConfig.threadCnt = 0
+
+        ep.libInit(ep_cfg)
+
+        # Transport 設定
+        sip_cfg = pj.TransportConfig()
+        sip_cfg.port = LOCAL_SIP_PORT
+        ep.transportCreate(pj.PJSIP_TRANSPORT_UDP, sip_cfg)
+
+        ep.libStart()
+        _log(f"[ep] PJSUA2 started, listening on UDP port {sip_cfg.port}")
+
+        # Account 設定
+        acc_cfg = pj.AccountConfig()
+        acc_cfg.idUri = f"sip:{SIP_USER}@{SIP_DOMAIN}"
+        acc_cfg.regConfig.registrarUri = f"sip:{SIP_DOMAIN}"
+
+        # 認證資訊
+        cred = pj.AuthCredInfo("digest", SIP_DOMAIN, SIP_USER, 0, SIP_PASSWD)
+        acc_cfg.sipConfig.authCreds.append(cred)
+
+        # 建立帳號
+        acc = MyAccount()
+        acc.create(acc_cfg)
+        _log(f"[acc] Created and registering as {acc_cfg.idUri}")
+
+        # 主執行緒直接睡到 Ctrl+C / SIGTERM，pjsua2 有自己的 worker threads
+        # (PJ_SINGLE_THREAD 時改成在這裡跑 event loop)
+        stop_evt = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop_evt.set())
+
+        try:
+            if PJ_SINGLE_THREAD:
+                while not stop_evt.is_set():
+                    ep.libHandleEvents(50)
+            else:
+                stop_evt.wait()
+            _log("\n[ep] Ctrl+C / SIGTERM, shutting down...")
+        finally:
+            ep.libDestroy()
+            _log("[ep] libDestroy done.")
     finally:
-        ep.libDestroy()
-        print("[ep] libDestroy done.")
+        # 把 queue 裡剩下的 log 印完再離開
+        _log_q.put(None)
+        _log_thread.join(timeout=1.0)
 
 
 if __name__ == "__main__":
@@ -2,6 +2,12 @@
 
 
 #!/usr/bin/env python3
+import ctypes
+import fcntl
+import os
+import queue
+import selectors
+import signal
 import subprocess
 import threading
 import time
@@ -17,39 +23,165 @@ WIDTH = 1280
 HEIGHT = 720
 FPS = 25
 
+# Frames travel as planar yuv420p (1.5 bytes/pixel instead of bgr24's 3):
+# one 2-D uint8 array holding the Y plane, then U, then V.
+# WIDTH and HEIGHT must be even.
+FRAME_SHAPE = (HEIGHT * 3 // 2, WIDTH)
+
 # Audio settings
 AUDIO_SAMPLE_RATE = 48000  # Hz
 
+# ffmpeg pipes: kernel pipe capacity / Python read buffer (bytes).
+# 1 MiB is the default /proc/sys/fs/pipe-max-size for unprivileged users.
+FFMPEG_PIPE_SIZE = 1 << 20
+
+# H.264 encoder: "libx264" (CPU), or hardware "h264_nvenc" (NVIDIA),
+# "h264_vaapi" (Intel/AMD via VAAPI_DEVICE), "h264_qsv" (Intel Quick Sync)
+VIDEO_ENCODER = "libx264"
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
+# Input mode video noise: False = blend in Python (cv2.addWeighted),
+# True = forward input frames untouched and let ffmpeg's noise filter add it
+BLEND_NOISE_IN_FFMPEG = False
+
 # If we haven't seen a frame from /abc/in within this many seconds, use noise
 SOURCE_TIMEOUT_SEC = 1.0
 
+# Reader's RTSP socket I/O timeout: a stalled/half-open session makes the
+# decoder exit after this long, so the reader reconnects instead of blocking
+# forever (ffmpeg's default is no timeout)
+READ_TIMEOUT_SEC = 10
+
+# fcntl.F_SETPIPE_SZ only exists on Linux builds of Python 3.10+
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+# Set once on shutdown; every background loop checks/waits on it
+SHUTDOWN = threading.Event()
+
+# prctl(PR_SET_PDEATHSIG) is Linux-only; resolved here, not in the forked child
+PR_SET_PDEATHSIG = 1
+try:
+    _prctl = ctypes.CDLL(None, use_errno=True).prctl
+except (OSError, AttributeError):
+    _prctl = None
+_PARENT_PID = os.getpid()
+
+
+def _die_with_parent():
+    """
+    Popen preexec_fn: have the kernel SIGTERM the child when we die, even
+    on SIGKILL / OOM kill / a native crash where no Python cleanup runs.
+    """
+    if _prctl is None:
+        return
+    _prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    # Parent already gone before prctl took effect
+    if os.getppid() != _PARENT_PID:
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _video_encode_args(fps):
+    """
+    ffmpeg output args for VIDEO_ENCODER (codec, latency tuning, GOP).
+    """
+    gop = str(fps * 2)
+    if VIDEO_ENCODER == "h264_nvenc":
+        return [
+            "-c:v", "h264_nvenc",
+            "-preset", "p1",
+            "-tune", "ll",
+            "-zerolatency", "1",
+            "-rc", "cbr",
+            "-b:v", "2M",
+            "-pix_fmt", "yuv420p",
+            "-profile:v", "baseline",
+            "-g", gop,
+        ]
+    if VIDEO_ENCODER == "h264_qsv":
+        return [
+            "-c:v", "h264_qsv",
+            "-preset", "veryfast",
+            "-pix_fmt", "nv12",
+            "-g", gop,
+        ]
+    if VIDEO_ENCODER == "h264_vaapi":
+        # Frames are uploaded to the GPU by the filter from _vaapi_upload()
+        return [
+            "-c:v", "h264_vaapi",
+            "-g", gop,
+        ]
+    return [
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-tune", "zerolatency",
+        "-pix_fmt", "yuv420p",
+        "-profile:v", "baseline",
+        "-g", gop,
+    ]
+
+
+def _vaapi_upload():
+    """
+    Returns (global_args, filter) needed to get frames onto the VAAPI
+    device, or ([], None) for the other encoders.
+    """
+    if VIDEO_ENCODER == "h264_vaapi":
+        return ["-vaapi_device", VAAPI_DEVICE], "format=nv12,hwupload"
+    return [], None
+
 
 def start_ffmpeg(mode, width, height, fps, in_url, out_url):
     """
-    Start an ffmpeg process based on mode ('input' or 'noise').
+    Start an ffmpeg process based on mode ('input', 'input_passthrough'
+    or 'noise').
 
     - 'input':  video from stdin, audio = /abc/in + white noise mix
-    - 'noise':  video from stdin, audio from anoisesrc (white noise)
+    - 'input_passthrough': like 'input', but the stdin video is the raw
+                input and ffmpeg adds the video noise itself
+    - 'noise':  video snow generated by ffmpeg itself (no stdin),
+                audio from anoisesrc (white noise)
     """
     common_video_input = [
-        # VIDEO INPUT from stdin (OpenCV BGR)
+        # VIDEO INPUT from stdin (planar yuv420p, x264's native format)
         "-f", "rawvideo",
-        "-pix_fmt", "bgr24",
+        "-pix_fmt", "yuv420p",
         "-s", f"{width}x{height}",
         "-r", str(fps),
         "-i", "-",  # video input 0
     ]
 
-    if mode == "input":
+    hw_args, hw_upload = _vaapi_upload()
+
+    if mode in ("input", "input_passthrough"):
+        # Video noise overlay done by ffmpeg (passthrough) or already in stdin,
+        # plus the GPU upload for VAAPI
+        video_chain = []
+        if mode == "input_passthrough":
+            video_chain.append("noise=alls=20:allf=t+u")
+        if hw_upload:
+            video_chain.append(hw_upload)
+        if video_chain:
+            video_filter = f"[0:v]{','.join(video_chain)}[vout];"
+            video_map = "[vout]"
+        else:
+            video_filter = ""
+            video_map = "0:v:0"
+
         # Use RTSP audio from IN_URL + anoisesrc, mix them (約 9:1)
         cmd = [
             "ffmpeg",
             "-loglevel", "warning",
+            *hw_args,
 
             # Video from stdin
             *common_video_input,
 
-            # RTSP input for audio (and ignore its video)
+            # RTSP input for audio (and ignore its video); skip the default
+            # ~5 s probe (SDP already describes the streams) and don't buffer
+            "-fflags", "nobuffer",
+            "-flags", "low_delay",
+            "-probesize", "32",
+            "-analyzeduration", "0",
             "-rtsp_transport", "tcp",
             "-i", in_url,  # input 1 (audio from /abc/in)
 
@@ -59,20 +191,16 @@ def start_ffmpeg(mode, width, height, fps, in_url, out_url):
 
             # Audio mix: [1:a]*9 + [2:a]*1 -> [aout]
             "-filter_complex",
+            f"{video_filter}"
             "[1:a]volume=9[a1];[2:a]volume=1[a2];"
             "[a1][a2]amix=inputs=2:duration=longest[aout]",
 
-            # Map: video from stdin (0:v), mixed audio [aout]
-            "-map", "0:v:0",
+            # Map: video from stdin (0:v, or noised [vout]), mixed audio [aout]
+            "-map", video_map,
             "-map", "[aout]",
 
             # Video encode
-            "-c:v", "libx264",
-            "-preset", "veryfast",
-            "-tune", "zerolatency",
-            "-pix_fmt", "yuv420p",
-            "-profile:v", "baseline",
-            "-g", str(fps * 2),
+            *_video_encode_args(fps),
 
             # Audio encode
             "-c:a", "aac",
@@ -85,29 +213,31 @@ def start_ffmpeg(mode, width, height, fps, in_url, out_url):
             out_url,
         ]
     else:
-        # 'noise' mode: white noise audio only
+        # 'noise' mode: white noise video + audio, both synthesized by ffmpeg
         cmd = [
             "ffmpeg",
             "-loglevel", "warning",
+            *hw_args,
 
-            # Video from stdin
-            *common_video_input,
+            # VIDEO INPUT: flat gray + temporal uniform noise = video snow (input 0).
+            # lavfi sources run as fast as the encoder can go; -re reads them at
+            # native rate, replacing the pacing the stdin writes gave before
+            "-re",
+            "-f", "lavfi",
+            "-i", f"color=c=gray:s={width}x{height}:r={fps},noise=alls=100:allf=t+u",
 
-            # AUDIO INPUT: generated white noise
+            # AUDIO INPUT: generated white noise (also paced with -re)
+            "-re",
             "-f", "lavfi",
             "-i", f"anoisesrc=c=white:r={AUDIO_SAMPLE_RATE}:a=0.1",  # input 1
 
-            # Map: video from stdin (0:v), audio from anoisesrc (1:a)
+            # Map: video from lavfi (0:v), audio from anoisesrc (1:a)
             "-map", "0:v:0",
             "-map", "1:a:0",
+            *(["-vf", hw_upload] if hw_upload else []),
 
             # Video encode
-            "-c:v", "libx264",
-            "-preset", "veryfast",
-            "-tune", "zerolatency",
-            "-pix_fmt", "yuv420p",
-            "-profile:v", "baseline",
-            "-g", str(fps * 2),
+            *_video_encode_args(fps),
 
             # Audio encode
             "-c:a", "aac",
@@ -121,104 +251,297 @@ def start_ffmpeg(mode, width, height, fps, in_url, out_url):
         ]
 
     print(f"[ffmpeg] Starting ffmpeg in {mode.upper()} mode")
-    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    # Only the input modes read video from stdin
+    stdin = subprocess.PIPE if mode != "noise" else subprocess.DEVNULL
+    # Unbuffered stdin: FrameWriter writes to the raw fd itself.
+    # Own process group so stop_ffmpeg can signal ffmpeg and any helpers at once.
+    # Noise mode has no stdin to EOF, so tie ffmpeg's lifetime to ours
+    # explicitly (start_ffmpeg only runs on the main thread, which lives as
+    # long as the process: PDEATHSIG fires on the spawning thread's exit)
+    proc = subprocess.Popen(
+        cmd,
+        stdin=stdin,
+        bufsize=0,
+        start_new_session=True,
+        preexec_fn=_die_with_parent,
+    )
+    if proc.stdin is not None:
+        # Grow the kernel pipe (64 KiB default) so a frame write rarely blocks
+        try:
+            fcntl.fcntl(proc.stdin.fileno(), F_SETPIPE_SZ, FFMPEG_PIPE_SIZE)
+        except OSError as e:
+            print(f"[ffmpeg] Could not resize stdin pipe: {e}", file=sys.stderr)
+    return proc
 
 
 class RtspReader(threading.Thread):
     """
     Background thread that continuously tries to read frames from IN_URL.
+    A dedicated ffmpeg decodes the stream and scales it to width x height
+    (yuv420p), so frames come out ready to blend and encode.
     Keeps only the most recent frame + timestamp.
     """
 
-    def __init__(self, url):
+    def __init__(self, url, width, height):
         super().__init__(daemon=True)
         self.url = url
-        self.cap = None
-        self.lock = threading.Lock()
-        self.latest_frame = None
-        self.last_frame_ts = 0.0
-        self.stop_flag = False
+        self.width = width
+        self.height = height
+        self.frame_size = width * height * 3 // 2
+        self.proc = None
+        # (frame, monotonic ts), replaced as a whole: a single reference
+        # store/load is atomic, so neither side needs a lock
+        self.latest = None
 
     def run(self):
-        while not self.stop_flag:
-            if self.cap is None or not self.cap.isOpened():
+        while not SHUTDOWN.is_set():
+            if self.proc is None:
                 # Try to (re)open the RTSP input
-                self._open_capture()
-                # Small pause before next attempt
-                time.sleep(1.0)
+                self._open_decoder()
+                if self.proc is None:
+                    # Small pause before next attempt (returns early on shutdown)
+                    SHUTDOWN.wait(1.0)
                 continue
 
-            ret, frame = self.cap.read()
-            if not ret or frame is None:
-                # Lost the stream; close and retry
-                self.cap.release()
-                self.cap = None
-                time.sleep(1.0)
+            frame = self._read_frame()
+            if frame is None:
+                # Lost the stream (ffmpeg exited); close and retry
+                self._close_decoder()
+                SHUTDOWN.wait(1.0)
                 continue
 
-            with self.lock:
-                self.latest_frame = frame
-                self.last_frame_ts = time.time()
+            self.latest = (frame, time.monotonic())
+
+        # stop() may have run while _open_decoder() was spawning a new
+        # decoder; make sure that one doesn't outlive us
+        if self.proc is not None:
+            self._close_decoder()
 
-    def _open_capture(self):
+    def _open_decoder(self):
+        cmd = [
+            "ffmpeg",
+            "-loglevel", "warning",
+
+            # Low-latency RTSP input: no input buffering, minimal delay
+            "-rtsp_transport", "tcp",
+            "-fflags", "nobuffer",
+            "-flags", "low_delay",
+            # Socket I/O timeout in microseconds (ffmpeg 5+; -stimeout before that)
+            "-timeout", str(READ_TIMEOUT_SEC * 1000000),
+            "-i", self.url,
+
+            # Video only, scaled by swscale to the output size
+            "-an",
+            "-vf", f"scale={self.width}:{self.height}",
+
+            # Raw yuv420p frames on stdout
+            "-f", "rawvideo",
+            "-pix_fmt", "yuv420p",
+            "-",
+        ]
         try:
-            # You can tweak backend & options if needed:
-            # self.cap = cv2.VideoCapture(self.url, cv2.CAP_FFMPEG)
-            self.cap = cv2.VideoCapture(self.url)
-        except Exception as e:
-            print(f"[reader] Failed to open {self.url}: {e}", file=sys.stderr)
-            self.cap = None
+            self.proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                bufsize=FFMPEG_PIPE_SIZE,
+                start_new_session=True,
+            )
+        except OSError as e:
+            print(f"[reader] Failed to start decoder for {self.url}: {e}", file=sys.stderr)
+            self.proc = None
+
+    def _read_frame(self):
+        # Read exactly one frame straight into a new array (no bytes copy)
+        frame = np.empty((self.height * 3 // 2, self.width), dtype=np.uint8)
+        view = frame.data.cast("B")
+        got = 0
+        while got < self.frame_size:
+            n = self.proc.stdout.readinto(view[got:])
+            if not n:
+                return None
+            got += n
+        return frame
+
+    def _close_decoder(self):
+        stop_ffmpeg(self.proc)
+        self.proc.stdout.close()
+        self.proc = None
 
     def get_latest_frame(self):
         """
         Returns (frame, age_seconds) or (None, None) if no frame yet.
         """
-        with self.lock:
-            frame = self.latest_frame
-            ts = self.last_frame_ts
-        if frame is None:
+        latest = self.latest
+        if latest is None:
             return None, None
-        age = time.time() - ts
+        frame, ts = latest
+        age = time.monotonic() - ts
         return frame, age
 
     def stop(self):
-        self.stop_flag = True
-        if self.cap is not None:
-            self.cap.release()
+        SHUTDOWN.set()
+        # Killing the decoder unblocks a pending read with EOF
+        proc = self.proc
+        if proc is not None:
+            stop_ffmpeg(proc)
+
+
+class FrameWriter(threading.Thread):
+    """
+    Background thread that writes finished frames to ffmpeg's stdin, so a
+    slow pipe never stalls frame generation in the main loop.
+    Frames live in a small pool of preallocated buffers; when every buffer
+    is still queued for writing, the main loop drops the new frame.
+    Each queued frame carries its own dup of ffmpeg's stdin fd, so closing
+    stdin in stop_ffmpeg can never leave the writer holding a stale fd
+    number that a newly started ffmpeg has reused.
+    """
+
+    def __init__(self, shape, pool_size=4):
+        super().__init__(daemon=True)
+        self.bufs = [np.empty(shape, dtype=np.uint8) for _ in range(pool_size)]
+        self.free_q = queue.SimpleQueue()
+        for idx in range(pool_size):
+            self.free_q.put(idx)
+        self.send_q = queue.SimpleQueue()
+        # ffmpeg process whose stdin failed; main loop restarts it
+        self.broken = None
+
+    def acquire(self):
+        """
+        Returns the index of a free buffer, or None if the writer is behind.
+        """
+        try:
+            return self.free_q.get_nowait()
+        except queue.Empty:
+            return None
+
+    def submit(self, ffmpeg, idx, frame=None):
+        """
+        Queue pool buffer `idx` for writing. If `frame` is given it is
+        written instead (idx then only holds its place in the pool); it
+        must not be modified afterwards.
+        Must be called from the thread that owns (and closes) ffmpeg.stdin.
+        """
+        try:
+            fd = os.dup(ffmpeg.stdin.fileno())
+        except OSError:
+            self.broken = ffmpeg
+            self.free_q.put(idx)
+            return
+        self.send_q.put((ffmpeg, fd, idx, frame))
+
+    def run(self):
+        while True:
+            item = self.send_q.get()
+            if item is None:
+                break
+            ffmpeg, fd, idx, frame = item
+            if frame is None:
+                frame = self.bufs[idx]
+            try:
+                if ffmpeg is not self.broken:
+                    self._write_frame(fd, frame)
+            except OSError:
+                # BrokenPipeError: ffmpeg exited (or was stopped) mid-stream
+                self.broken = ffmpeg
+            finally:
+                os.close(fd)
+                self.free_q.put(idx)
+
+    @staticmethod
+    def _write_frame(fd, frame):
+        # Straight from the array's buffer (no tobytes() copy), bypassing
+        # Python's BufferedWriter; loop on short writes
+        view = frame.data.cast("B")
+        while view:
+            n = os.writev(fd, [view])
+            view = view[n:]
+
+    def stop(self):
+        self.send_q.put(None)
+
+
+def _wait_exit(proc, timeout):
+    """
+    Wait up to `timeout` seconds for proc to exit; True if it did.
+    On Linux 5.3+ sleeps on a pidfd (wakes right at exit) instead of
+    Popen.wait(timeout)'s sleep/poll loop.
+    """
+    try:
+        pidfd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        try:
+            proc.wait(timeout=timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+    try:
+        with selectors.DefaultSelector() as sel:
+            sel.register(pidfd, selectors.EVENT_READ)
+            sel.select(timeout)
+    finally:
+        os.close(pidfd)
+    # Reap it (or report still running)
+    return proc.poll() is not None
 
 
 def stop_ffmpeg(ffmpeg):
     if ffmpeg is None:
         return
     try:
-        if ffmpeg.stdin:
+        if ffmpeg.poll() is None:
             try:
-                ffmpeg.stdin.close()
-            except Exception:
+                os.killpg(ffmpeg.pid, signal.SIGTERM)
+            except ProcessLookupError:
                 pass
-        if ffmpeg.poll() is None:
-            ffmpeg.terminate()
+            if not _wait_exit(ffmpeg, 3.0):
+                os.killpg(ffmpeg.pid, signal.SIGKILL)
+                ffmpeg.wait()
     except Exception:
         pass
+    # Close stdin only once ffmpeg is gone. The FrameWriter writes through
+    # its own dup of the fd, so a pending write fails with EPIPE instead of
+    # landing on whatever reuses this fd number
+    if ffmpeg.stdin:
+        try:
+            ffmpeg.stdin.close()
+        except Exception:
+            pass
 
 
 def main():
-    reader = RtspReader(IN_URL)
+    # The ffmpegs run in their own sessions (no terminal signals, and noise
+    # mode has no stdin to EOF), so kill/terminal close must also go through
+    # the cleanup below instead of leaving them publishing to OUT_URL
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, lambda *_: SHUTDOWN.set())
+
+    reader = RtspReader(IN_URL, WIDTH, HEIGHT)
     reader.start()
     print(f"[main] Started RTSP reader for {IN_URL}")
 
+    writer = FrameWriter(FRAME_SHAPE)
+    writer.start()
+
     frame_interval = 1.0 / FPS
     using_input = False
     last_status_print = 0.0
 
+    # Noise buffer, allocated once and reused (~1.4 MB); output frames
+    # come from the writer's buffer pool
+    noise_buf = np.empty(FRAME_SHAPE, dtype=np.uint8)
+
     # ffmpeg process + mode tracking
     ffmpeg = None
-    current_mode = None  # "input" or "noise"
+    current_mode = None  # "input", "input_passthrough" or "noise"
 
-    try:
-        while True:
-            loop_start = time.time()
+    # Frame pacing on a fixed monotonic schedule (immune to clock jumps, no drift)
+    next_deadline = time.monotonic() + frame_interval
 
+    try:
+        while not SHUTDOWN.is_set():
             # Get freshest frame from /abc/in (if any)
             in_frame, age = reader.get_latest_frame()
             use_input = (
@@ -228,7 +551,19 @@ def main():
             )
 
             # Decide desired mode based on whether we have fresh input
-            desired_mode = "input" if use_input else "noise"
+            if not use_input:
+                desired_mode = "noise"
+            elif BLEND_NOISE_IN_FFMPEG:
+                desired_mode = "input_passthrough"
+            else:
+                desired_mode = "input"
+
+            # Writer thread hit a broken pipe -> restart ffmpeg
+            if ffmpeg is not None and writer.broken is ffmpeg:
+                print("[main] Broken pipe to ffmpeg, will restart.", file=sys.stderr)
+                stop_ffmpeg(ffmpeg)
+                ffmpeg = None
+                current_mode = None
 
             # If ffmpeg died for any reason, force restart in desired_mode
             if ffmpeg is not None and ffmpeg.poll() is not None:
@@ -244,26 +579,6 @@ def main():
                 ffmpeg = start_ffmpeg(desired_mode, WIDTH, HEIGHT, FPS, IN_URL, OUT_URL)
                 current_mode = desired_mode
 
-            # ---- Build the frame to send (input + noise overlay) ----
-            # Base noise frame
-            noise_frame = np.random.randint(
-                0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8
-            )
-
-            if use_input and in_frame is not None:
-                # Resize to our output size if needed
-                if (in_frame.shape[1] != WIDTH) or (in_frame.shape[0] != HEIGHT):
-                    in_resized = cv2.resize(in_frame, (WIDTH, HEIGHT))
-                else:
-                    in_resized = in_frame
-
-                # Blend input video (9) and noise (1)
-                # frame = 0.9 * in_resized + 0.1 * noise_frame
-                frame = cv2.addWeighted(in_resized, 0.9, noise_frame, 0.1, 0)
-            else:
-                # No fresh input -> pure white noise (video snow)
-                frame = noise_frame
-
             # Debug print when video mode changes or every ~5 seconds
             now = time.time()
             if use_input != using_input or (now - last_status_print) > 5.0:
@@ -279,30 +594,53 @@ def main():
                 ffmpeg = start_ffmpeg(desired_mode, WIDTH, HEIGHT, FPS, IN_URL, OUT_URL)
                 current_mode = desired_mode
 
-            # Write frame to ffmpeg stdin
-            try:
-                ffmpeg.stdin.write(frame.tobytes())
-            except (BrokenPipeError, OSError):
-                print("[main] Broken pipe to ffmpeg, will restart.", file=sys.stderr)
-                stop_ffmpeg(ffmpeg)
-                ffmpeg = None
-                current_mode = None
-                # skip sleep; next loop will restart ffmpeg
-                continue
+            # In 'noise' mode ffmpeg synthesizes the video itself; nothing to send
+            # (and if every pool buffer is still queued, drop this frame)
+            idx = writer.acquire() if current_mode != "noise" else None
+            if idx is not None and current_mode == "input_passthrough":
+                # ffmpeg adds the noise; reader frames are never modified
+                # after publishing, so send the input frame as-is
+                writer.submit(ffmpeg, idx, in_frame)
+            elif idx is not None:
+                # ---- Build the frame to send (input + noise overlay) ----
+                # Base noise frame, filled in place by OpenCV's RNG
+                cv2.randu(noise_buf, 0, 256)
+
+                # Blend input video (9) and noise (1) into a pool buffer;
+                # the reader already delivers yuv420p frames at WIDTH x HEIGHT.
+                # Blending is linear, so doing it per Y/U/V plane matches the
+                # old BGR blend up to the shape of the noise itself.
+                # frame = 0.9 * in_frame + 0.1 * noise_buf
+                cv2.addWeighted(in_frame, 0.9, noise_buf, 0.1, 0, dst=writer.bufs[idx])
+
+                # Hand off to the writer thread
+                writer.submit(ffmpeg, idx)
+
+            # Keep real-time pace
+            now = time.monotonic()
+            if now < next_deadline:
+                time.sleep(next_deadline - now)
+                next_deadline += frame_interval
+            elif now > next_deadline + frame_interval:
+                # More than a frame behind: resync instead of bursting to catch up
+                next_deadline = now + frame_interval
+            else:
+                next_deadline += frame_interval
 
-            # Keep roughly real-time pace
-            elapsed = time.time() - loop_start
-            sleep_time = frame_interval - elapsed
-            if sleep_time > 0:
-                time.sleep(sleep_time)
+        print("[main] SIGTERM / SIGHUP received, exiting.")
 
     except KeyboardInterrupt:
         print("\n[main] Ctrl+C received, exiting.")
 
     finally:
+        SHUTDOWN.set()
         reader.stop()
-        reader.join()
+        # Daemon thread: don't hang on a blocked read at exit
+        reader.join(timeout=2.0)
+        # Stopping ffmpeg first unblocks a writer stuck on a full pipe
         stop_ffmpeg(ffmpeg)
+        writer.stop()
+        writer.join(timeout=2.0)
         print("[main] Clean shutdown")
 
 